@@ -1,13 +1,29 @@
 from __future__ import annotations
 
+import bz2
+import csv
+import gzip
+import hashlib
 import io
+import lzma
+import tempfile
+import time
 import unicodedata
+import urllib.parse
+import urllib.request
+import uuid
+import zipfile
+from pathlib import Path
 from typing import Optional, Tuple, List
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import streamlit as st
 import pydeck as pdk
+import xxhash
 
 # =============================================================================
 # Configuração da página
@@ -26,6 +42,16 @@ DEFAULT_URL = (
     "sangue-tecidos-celulas-e-orgaos/producao-e-avaliacao-de-servicos-de-hemoterapia/"
     "dados-brutos-de-producao-hemoterapica-1/hemoprod_nacional.csv"
 )
+CACHE_TTL = 3600  # segundos
+LIMITE_PREVIA = 10_000  # linhas exibidas de uploads grandes
+# cópia local da base padrão (uma por URL): evita baixar e reprocessar o CSV a cada cold start
+# incrementar a versão ao mudar `le_csv_bytes`/`normaliza_colunas`/`otimiza_tipos`: o nome novo
+# descarta cópias gravadas por código antigo, que o ETag sozinho manteria para sempre
+PARQUET_CACHE_VERSAO = 2
+PARQUET_CACHE = Path(tempfile.gettempdir()) / (
+    f"hemoprod_v{PARQUET_CACHE_VERSAO}_{hashlib.sha1(DEFAULT_URL.encode()).hexdigest()[:12]}.parquet"
+)
+ETAG_CACHE = PARQUET_CACHE.with_suffix(".etag")
 
 # centroides aproximados por UF (para o mapa)
 UF_CENTER = {
@@ -39,6 +65,20 @@ UF_CENTER = {
     "RR": (2.7376, -62.0751),  "RS": (-29.3344, -53.5000), "SC": (-27.2423, -50.2189),
     "SE": (-10.5741, -37.3857), "SP": (-22.19, -48.79),     "TO": (-10.1753, -48.2982)
 }
+# derivados de UF_CENTER (as chaves já estão em ordem alfabética)
+UF_SIGLAS = list(UF_CENTER)
+UF_DTYPE = pd.CategoricalDtype(UF_SIGLAS)
+UFS_CORRECAO_SOMA = frozenset({"RJ", "SP"})  # Soma zerada -> usa a contagem
+
+# O Streamlit reexecuta este script a cada interação: tabelas de apoio imutáveis ficam em
+# st.cache_resource (uma instância por processo, compartilhada entre sessões; não alterar)
+@st.cache_resource(show_spinner=False)
+def _uf_center_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        [(uf, lat, lon) for uf, (lat, lon) in UF_CENTER.items()], columns=["uf", "lat", "lon"]
+    )
+
+UF_CENTER_DF = _uf_center_df()
 
 # normalização de nomes -> siglas
 UF_NOMES = {
@@ -84,26 +124,104 @@ LINKS_OFICIAIS = {
     "SP": "https://www.prosangue.sp.gov.br/",
     "TO": "https://www.to.gov.br/saude/hemorrede/",
 }
+BUSCA_URL = "https://www.google.com/search?q=doar+sangue+{uf}+hemocentro"
+
+# tabela da página de hemocentros
+@st.cache_resource(show_spinner=False)
+def _links_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "UF": UF_SIGLAS,
+            "Site oficial": [LINKS_OFICIAIS.get(u, "") for u in UF_CENTER],
+            "Busca (fallback)": [BUSCA_URL.format(uf=u) for u in UF_CENTER],
+        }
+    )
+
+LINKS_DF = _links_df()
+
+# vista inicial e tooltip do mapa: montados uma vez por processo, só quando há mapa
+@st.cache_resource(show_spinner=False)
+def _mapa_config() -> Tuple[pdk.ViewState, dict]:
+    return (
+        pdk.ViewState(latitude=-14.2350, longitude=-51.9253, zoom=3.5),
+        {"text": "{uf}: {valor_formatado}"},
+    )
+
+# montado só quando a página de hemocentros é aberta, uma vez por processo
+@st.cache_resource(show_spinner=False)
+def _links_column_config() -> dict:
+    return {
+        "Site oficial": st.column_config.LinkColumn("Site oficial", display_text="Abrir"),
+        "Busca (fallback)": st.column_config.LinkColumn("Busca (fallback)", display_text="Abrir"),
+    }
 # --------------------------------------------------------------------
 
+# separador de milhar ("." ou espaço não separável) some; vírgula decimal vira ponto
+_NUM_TROCAS = ((".", ""), ("\u00A0", ""), (",", "."))
+# o que sobra e ainda é número (o cast do Arrow não tem errors="coerce")
+_NUM_RE = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+
 
 # =============================================================================
 # Utilidades
 # =============================================================================
 def strip_accents_upper(s: str) -> str:
-    s = unicodedata.normalize("NFD", (s or "")).encode("ascii", "ignore").decode("ascii")
+    if not s:
+        return ""
+    if not s.isascii():  # texto ASCII não tem acento a remover
+        s = unicodedata.normalize("NFD", s).encode("ascii", "ignore").decode("ascii")
     return " ".join(s.upper().split())
 
-def uf_para_sigla(valor: str) -> str | None:
-    if valor is None or str(valor).strip() == "":
-        return None
-    v = str(valor).strip()
-    if len(v) <= 2:  # já é sigla
-        return v.upper()
-    v2 = strip_accents_upper(v)
-    return UF_NOMES.get(v2)
+# variantes usuais de grafia (caixa, acentos) -> sigla, resolvidas com um único lookup
+@st.cache_resource(show_spinner=False)
+def _uf_direct() -> dict:
+    direto = {}
+    for nome, sigla in [*UF_NOMES.items(), *((u, u) for u in UF_CENTER)]:
+        for base in (nome, strip_accents_upper(nome)):
+            for variante in (base, base.lower(), base.title()):
+                direto[variante] = sigla
+    return direto
+
+_UF_DIRECT = _uf_direct()
+
+def ufs_para_siglas(serie: pd.Series) -> pd.Series:
+    """Nome ou sigla de UF -> sigla, vetorizado; texto não reconhecido volta em maiúsculas."""
+    # a coluna tem poucos valores distintos: normaliza só os únicos e espalha pelos códigos
+    codigos, unicos = pd.factorize(serie)
+    v = pd.Series(unicos).astype("string").str.strip()
+    siglas = v.map(_UF_DIRECT)  # grafias conhecidas: acerto direto, sem normalização
+
+    resto = v[siglas.isna() & v.notna()]
+    upper = resto.str.upper()
+    # só a minoria não-ASCII passa pela normalização Unicode
+    nao_ascii = resto.str.contains(r"[^\x00-\x7F]", regex=True, na=False)
+    sem_acento = resto.mask(
+        nao_ascii,
+        resto[nao_ascii].str.normalize("NFD").str.encode("ascii", "ignore").str.decode("ascii"),
+    )
+    nomes = sem_acento.str.upper().str.split().str.join(" ").map(UF_NOMES)
+    # siglas (<= 2 caracteres) passam direto; nomes não reconhecidos mantêm o texto original
+    siglas = siglas.fillna(upper.where(resto.str.len() <= 2, nomes).fillna(upper))
+
+    valores = np.append(siglas.to_numpy(dtype=object, na_value=None), None)  # código -1 (nulo) -> None
+    return pd.Series(valores[codigos], index=serie.index, dtype="string")
+
+def n_distintos(s: pd.Series) -> int:
+    # `pd.unique` direto no ndarray evita as camadas extras de `Series.nunique`
+    u = pd.unique(s.to_numpy())
+    return int((~pd.isna(u)).sum())
 
 def format_number(x: float) -> str:
+    # caminho rápido para escalares nativos (KPIs), sem `pd.isna`/try
+    if isinstance(x, (int, np.integer)):
+        return f"{x:,}".replace(",", ".")
+    if isinstance(x, (float, np.floating)):
+        if x != x:
+            return "-"
+        if x.is_integer():
+            return f"{int(x):,}".replace(",", ".")
+        return f"{x:,.2f}".replace(",", ".")
+
     if pd.isna(x):
         return "-"
     try:
@@ -113,34 +231,142 @@ def format_number(x: float) -> str:
     except Exception:
         return str(x)
 
-@st.cache_data(show_spinner=False)
-def read_csv_robusto(origem: str | bytes, uploaded: bool = False) -> pd.DataFrame:
+def detecta_separador(amostra: bytes) -> str:
+    texto = amostra.decode("utf-8", errors="ignore")
+    texto = texto[: texto.rfind("\n") + 1] or texto  # só linhas completas
+    # o cabeçalho decide quando é inequívoco (vírgula decimal nos dados engana o Sniffer)
+    cabecalho = texto.split("\n", 1)[0]
+    contagens = sorted(((cabecalho.count(d), d) for d in ";,\t|"), reverse=True)
+    if contagens[0][0] > contagens[1][0]:
+        return contagens[0][1]
+    try:
+        return csv.Sniffer().sniff(texto, delimiters=";,\t|").delimiter
+    except csv.Error:
+        return ";"
+
+def le_csv_pyarrow(byts: bytes, sep: str) -> pd.DataFrame:
+    # tipos explícitos: o engine="pyarrow" do pandas infere números antes de aplicar dtype=str
+    # ("1.500" viraria "1.5"), então o leitor do pyarrow é usado direto, tudo como texto
+    cabecalho = byts.split(b"\n", 1)[0].decode("utf-8-sig").rstrip("\r")
+    nomes = next(csv.reader([cabecalho], delimiter=sep))
+    if len(set(nomes)) != len(nomes):
+        # o pyarrow mantém nomes repetidos; o parser C os renomeia ("qtd", "qtd.1")
+        raise ValueError("cabeçalho com colunas repetidas")
+    if any(not n for n in nomes):
+        # campo vazio (ex.: ";" no fim): o parser C o chama de "Unnamed: N", que
+        # `normaliza_colunas` descarta
+        raise ValueError("cabeçalho com coluna sem nome")
+    tabela = pacsv.read_csv(
+        io.BytesIO(byts),
+        parse_options=pacsv.ParseOptions(
+            delimiter=sep,
+            # colunas a mais: descarta (como on_bad_lines="skip"); colunas a menos: aborta e
+            # deixa para o parser C, que completa a linha com NaN
+            invalid_row_handler=lambda r: "skip" if r.actual_columns > r.expected_columns else "error",
+        ),
+        convert_options=pacsv.ConvertOptions(
+            column_types={n: pa.string() for n in nomes}, strings_can_be_null=True
+        ),
+    )
+    # nomes divergentes (ex.: quebra de linha entre aspas no cabeçalho) escapam do
+    # `column_types` e teriam o tipo inferido ("1.500" -> 1.5): devolve ao parser C
+    if tabela.column_names != nomes or not all(pa.types.is_string(t) for t in tabela.schema.types):
+        raise ValueError("cabeçalho lido pelo pyarrow difere do esperado")
+    return tabela.to_pandas()
+
+def format_series(s: pd.Series) -> pd.Series:
+    """Versão vetorizada de `format_number` (mesmo resultado, sem chamada por elemento)."""
+    arr = s.to_numpy(dtype=float, na_value=np.nan)
+    vazio = np.isnan(arr)
+    with np.errstate(invalid="ignore"):
+        inteiro = np.mod(arr, 1) == 0
+        # int64 só até 2**63; inteiros maiores (somas de IDs em float) saem por "%.0f", exato
+        cabe_int64 = inteiro & (np.abs(arr) < 2**63)
+    txt = np.where(cabe_int64, np.where(cabe_int64, arr, 0).astype(np.int64).astype(str), np.char.mod("%.2f", arr))
+    grandes = inteiro & ~cabe_int64
+    if grandes.any():
+        txt[grandes] = np.char.mod("%.0f", arr[grandes])
+    # separador de milhar "." inserido por regex em uma única passada
+    txt = pd.Series(txt, index=s.index).str.replace(r"(\d)(?=(\d{3})+(?!\d))", r"\1.", regex=True)
+    return txt.mask(vazio, "-")
+
+def etag_remoto(url: str) -> Optional[str]:
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=10) as resp:
+            return resp.headers.get("ETag")
+    except Exception:
+        return None
+
+def read_csv_robusto(origem: str | bytes, uploaded: bool = False, chave: Optional[str] = None) -> pd.DataFrame:
     if uploaded:
         byts = origem if isinstance(origem, (bytes, bytearray)) else origem.read()
-        buf = io.BytesIO(byts)
+        # chave = xxh3 do conteúdo: reenviar o mesmo arquivo não reprocessa o CSV
+        # (quem já calculou o digest o repassa em `chave`)
+        return _read_csv_upload(chave or xxhash.xxh3_64_hexdigest(byts), byts)
+    return _read_csv_url(origem)  # URL string
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _read_csv_url(url: str) -> pd.DataFrame:
+    return le_csv_bytes(baixa_bytes(url))
+
+def baixa_bytes(url: str) -> bytes:
+    """Conteúdo de uma URL ou caminho local, já descomprimido conforme a extensão."""
+    # como o pd.read_csv: sem esquema de rede, é caminho local ("C:\..." tem esquema "c")
+    if urllib.parse.urlparse(url).scheme in ("http", "https", "ftp", "file"):
+        with urllib.request.urlopen(url, timeout=60) as resp:
+            byts = resp.read()
     else:
-        buf = origem  # URL string
+        byts = Path(url).expanduser().read_bytes()
+
+    ext = Path(urllib.parse.urlparse(url).path).suffix.lower()
+    if ext == ".gz":
+        return gzip.decompress(byts)
+    if ext == ".bz2":
+        return bz2.decompress(byts)
+    if ext == ".xz":
+        return lzma.decompress(byts)
+    if ext == ".zip":
+        with zipfile.ZipFile(io.BytesIO(byts)) as zf:
+            return zf.read(zf.namelist()[0])
+    return byts
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _read_csv_upload(chave: str, _byts: bytes) -> pd.DataFrame:
+    return le_csv_bytes(_byts)
+
+def le_csv_bytes(byts: bytes) -> pd.DataFrame:
+    # separador detectado uma vez -> pyarrow (C++ multithread) e, se falhar, parser C;
+    # ambos bem mais rápidos que o "python"
+    sep = detecta_separador(byts[:65536])
+    for ler in (
+        lambda: le_csv_pyarrow(byts, sep),
+        lambda: pd.read_csv(io.BytesIO(byts), sep=sep, engine="c", on_bad_lines="skip", dtype=str),
+    ):
+        try:
+            df = ler()
+            if len(df.columns) > 1:
+                return df
+        except Exception:
+            pass
+
+    # último recurso: parser "python" com detecção automática, depois ";" e ","
+    for sep in (None, ";"):
+        try:
+            df = pd.read_csv(io.BytesIO(byts), sep=sep, engine="python", on_bad_lines="skip", dtype=str)
+            if not df.empty:
+                return df
+        except Exception:
+            pass
 
-    try:
-        df = pd.read_csv(buf, sep=None, engine="python", on_bad_lines="skip", dtype=str)
-        if not df.empty:
-            return df
-    except Exception:
-        pass
+    return pd.read_csv(io.BytesIO(byts), sep=",", engine="python", on_bad_lines="skip", dtype=str)
 
+def read_excel_rapido(byts: bytes) -> pd.DataFrame:
     try:
-        if uploaded:
-            buf.seek(0)
-        df = pd.read_csv(buf, sep=";", engine="python", on_bad_lines="skip", dtype=str)
-        if not df.empty:
-            return df
-    except Exception:
-        pass
-
-    if uploaded:
-        buf.seek(0)
-    df = pd.read_csv(buf, sep=",", engine="python", on_bad_lines="skip", dtype=str)
-    return df
+        # calamine (Rust) lê XLSX bem mais rápido que o openpyxl (Python puro)
+        return pd.read_excel(io.BytesIO(byts), dtype=str, engine="calamine")
+    except (ImportError, ValueError):
+        # python-calamine ausente ou pandas < 2.2 (sem o engine): cai no padrão
+        return pd.read_excel(io.BytesIO(byts), dtype=str)
 
 def normaliza_colunas(df: pd.DataFrame) -> pd.DataFrame:
     ren = {c: " ".join(c.strip().lower().split()) for c in df.columns}
@@ -167,10 +393,7 @@ def detecta_colunas(df: pd.DataFrame) -> Tuple[Optional[str], Optional[str], Lis
     for c in df.columns:
         if c in {col_ano, col_uf}:
             continue
-        amostra = pd.to_numeric(
-            df[c].dropna().astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
-            errors="coerce",
-        )
+        amostra = to_numeric_safe(df[c].dropna())
         if amostra.notna().sum() > 0:
             possiveis.append(c)
 
@@ -178,16 +401,223 @@ def detecta_colunas(df: pd.DataFrame) -> Tuple[Optional[str], Optional[str], Lis
         possiveis = ["id da resposta"] + [x for x in possiveis if x != "id da resposta"]
     return col_ano, col_uf, possiveis
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def detecta_colunas_base(df_id: str, _df: pd.DataFrame) -> Tuple[Optional[str], Optional[str], List[str]]:
+    # `_df` fica fora do hash do Streamlit: a chave é o id da base carregada
+    return detecta_colunas(_df)
+
 def to_numeric_safe(s: pd.Series) -> pd.Series:
-    return pd.to_numeric(
-        s.astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
-        errors="coerce",
+    if pd.api.types.is_numeric_dtype(s):
+        # já convertida na carga (ver `otimiza_tipos`); agrega em 64 bits, como antes
+        if pd.api.types.is_integer_dtype(s) and not s.hasnans:
+            return s.astype("int64")
+        return s.astype("float64")
+    # kernels de string do Arrow (C++) sobre o buffer contíguo, sem objetos Python por linha
+    arr = pa.array(s.astype("string"), type=pa.string())
+    for velho, novo in _NUM_TROCAS:
+        arr = pc.replace_substring(arr, velho, novo)
+    arr = pc.utf8_trim_whitespace(arr)
+    arr = pc.if_else(pc.match_substring_regex(arr, _NUM_RE), arr, None)
+    # como o pd.to_numeric: tudo inteiro e nada inválido -> int64; senão float64
+    inteiro = arr.null_count == 0 and pc.all(pc.match_substring_regex(arr, r"^-?\d{1,18}$")).as_py()
+    num = pc.cast(arr, pa.int64() if inteiro else pa.float64()).to_numpy(zero_copy_only=False)
+    return pd.Series(num, index=s.index, name=s.name)
+
+def otimiza_tipos(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte, uma única vez na carga, as colunas 100% numéricas para Int32/Int64/float64."""
+    convertidas = {}
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s):
+            continue
+        preenchidos = s.dropna().astype(str)
+        # vazias ou códigos com zero à esquerda (CNES, CEP...) continuam como texto
+        if preenchidos.empty or preenchidos.str.match(r"\s*0\d").any():
+            continue
+        # um único "." sem vírgula ("-23.5505", "2020.0") pode ser decimal em vez de milhar:
+        # ambíguo na leitura BR, então a coluna fica como texto, igual ao arquivo
+        if preenchidos.str.fullmatch(r"[^.,]*\.[^.,]*").any():
+            continue
+        num = to_numeric_safe(preenchidos)
+        if num.isna().any():
+            continue
+        if (num % 1 == 0).all():
+            # inteiro exato só pelo caminho int64 ou até 2**53 (limite do float64);
+            # IDs longos ("12345678901234567890", "1e30") continuam como texto
+            if not pd.api.types.is_integer_dtype(num) and not (num.abs() <= 2**53).all():
+                continue
+            cabe_int32 = num.between(np.iinfo(np.int32).min, np.iinfo(np.int32).max).all()
+            # a partir dos preenchidos: com NaN na coluna, o int64 passaria por float64
+            convertidas[c] = num.astype("Int32" if cabe_int32 else "Int64").reindex(s.index)
+        else:
+            # float32 perderia dígitos (~7 significativos) nas somas
+            convertidas[c] = num.reindex(s.index)
+    return df.assign(**convertidas) if convertidas else df
+
+# cache_resource: uma única instância compartilhada, sem pickle/cópia a cada acesso.
+# A base é somente leitura: o painel trabalha em projeções/`assign`, nunca altera `df`.
+# Devolve também um id estável (ETag ou mtime da cópia em disco): todas as sessões, e as
+# recargas com o mesmo conteúdo, compartilham as entradas dos caches por `df_id`.
+@st.cache_resource(ttl=CACHE_TTL, show_spinner="Carregando dados da ANVISA...")
+def get_default_dataframe() -> Tuple[pd.DataFrame, str]:
+    etag = None
+    try:
+        st_cache = PARQUET_CACHE.stat()
+        if time.time() - st_cache.st_mtime < CACHE_TTL:
+            try:
+                marca = ETAG_CACHE.read_text()
+            except OSError:
+                marca = str(st_cache.st_mtime_ns)
+            return pd.read_parquet(PARQUET_CACHE), f"padrao:v{PARQUET_CACHE_VERSAO}:{marca}"
+        # cópia vencida: se o CSV remoto não mudou (mesmo ETag), só renova a validade
+        etag = etag_remoto(DEFAULT_URL)
+        if etag and etag == ETAG_CACHE.read_text():
+            PARQUET_CACHE.touch()
+            return pd.read_parquet(PARQUET_CACHE), f"padrao:v{PARQUET_CACHE_VERSAO}:{etag}"
+    except Exception:
+        pass  # sem cache em disco (ou ilegível): baixa de novo
+
+    etag = etag or etag_remoto(DEFAULT_URL)
+    # download direto, fora do cache de `_read_csv_url`: a cópia em memória pode ser a versão
+    # antiga e acabaria gravada em disco junto com o ETag novo
+    df = otimiza_tipos(normaliza_colunas(le_csv_bytes(baixa_bytes(DEFAULT_URL))))
+    try:
+        # gravação atômica (temporário + replace); sem ETag durante a troca, uma queda no meio
+        # só força um novo download
+        ETAG_CACHE.unlink(missing_ok=True)
+        tmp = PARQUET_CACHE.with_name(f"{PARQUET_CACHE.name}.{uuid.uuid4().hex}.tmp")
+        df.to_parquet(tmp, compression="zstd", index=False)
+        tmp.replace(PARQUET_CACHE)
+        if etag:
+            tmp = ETAG_CACHE.with_name(f"{ETAG_CACHE.name}.{uuid.uuid4().hex}.tmp")
+            tmp.write_text(etag)
+            tmp.replace(ETAG_CACHE)
+    except Exception:
+        pass  # disco somente leitura etc.: segue só com o cache em memória
+    # sem ETag não há como reconhecer o conteúdo depois: id único desta instância
+    return df, f"padrao:v{PARQUET_CACHE_VERSAO}:{etag or uuid.uuid4().hex}"
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def siglas_uf_base(df_id: str, _df: pd.DataFrame, uf_col: str) -> pd.Series:
+    # normaliza a coluna UF uma vez por base; a categórica com as 27 siglas
+    # faz o groupby trabalhar sobre códigos inteiros em vez de strings
+    # texto fora das 27 siglas (nomes desconhecidos, vazios) vira NA antes da conversão
+    s = ufs_para_siglas(_df[uf_col])
+    return s.where(s.isin(UF_SIGLAS)).astype(UF_DTYPE)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def anos_base(df_id: str, _df: pd.DataFrame, col_ano: str) -> List[int]:
+    # anos distintos, do mais recente ao mais antigo (np.unique: uma ordenação só)
+    anos = pd.to_numeric(_df[col_ano], errors="coerce").dropna().to_numpy(dtype=np.int64)
+    return np.unique(anos)[::-1].tolist()
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def agrega_por_uf(
+    df_id: str,
+    _df: pd.DataFrame,
+    col_ano: Optional[str],
+    ano: Optional[int],
+    uf_col: Optional[str],
+    met_col: Optional[str],
+    oper: str,
+) -> Tuple[pd.DataFrame, int, int, int]:
+    """Filtra pelo ano e agrega por UF -> (grupo, registros, anos distintos, UFs distintas)."""
+    # cacheado por base/ano/colunas/operação: voltar a uma combinação já vista não refaz o groupby
+    # só as colunas usadas na agregação (sem clonar a base inteira)
+    usadas = [c for c in dict.fromkeys((col_ano, uf_col, met_col)) if c]
+    df_ag = _df[usadas]
+    if col_ano and ano is not None:
+        # compara no tipo da coluna (Int32 após `otimiza_tipos`, senão texto), sem `astype(str)`
+        anos = df_ag[col_ano]
+        df_ag = df_ag[anos == (ano if pd.api.types.is_numeric_dtype(anos) else str(ano))]
+
+    # KPIs: `len` é O(1) e, com um ano filtrado, "anos distintos" sai sem varrer a coluna;
+    # só a contagem de UFs precisa de uma passada
+    total_reg = len(df_ag)
+    if not col_ano:
+        anos_dist = 0
+    elif ano is not None:
+        anos_dist = int(total_reg > 0)
+    else:
+        anos_dist = n_distintos(df_ag[col_ano])
+    ufs_dist = n_distintos(df_ag[uf_col]) if uf_col else 0
+
+    if uf_col:
+        # alinhada às linhas filtradas: com `df_ag` vazio, o `assign` adotaria o índice
+        # da base inteira e o groupby contaria registros fora do filtro
+        df_ag = df_ag.assign(__uf__=siglas_uf_base(df_id, _df, uf_col).reindex(df_ag.index))
+
+        if oper == "Soma":
+            df_ag = df_ag.assign(__valor__=to_numeric_safe(df_ag[met_col]))
+            # soma e contagem no mesmo groupby (a contagem alimenta a correção abaixo)
+            grupo = (
+                df_ag.groupby("__uf__", observed=True, sort=False)["__valor__"]
+                .agg(valor="sum", cont="size")
+                .reset_index()
+                .rename(columns={"__uf__": "uf"})
+            )
+
+            # Correção apenas para RJ e SP quando Soma zerar
+            zerados = grupo["uf"].isin(UFS_CORRECAO_SOMA) & (grupo["valor"].isna() | (grupo["valor"] == 0))
+            grupo.loc[zerados, "valor"] = grupo.loc[zerados, "cont"].astype(float)
+            grupo = grupo.drop(columns="cont")
+        else:
+            # Contagem: tamanho de cada grupo, sem materializar uma coluna constante de 1.0
+            grupo = (
+                df_ag.groupby("__uf__", observed=True, sort=False)
+                .size()
+                .astype(float)
+                .reset_index(name="valor")
+                .rename(columns={"__uf__": "uf"})
+            )
+        grupo["uf"] = grupo["uf"].astype(str)
+    else:
+        grupo = pd.DataFrame(columns=["uf", "valor"])
+    return grupo, total_reg, anos_dist, ufs_dist
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def monta_mapa(
+    df_id: str,
+    col_ano: Optional[str],
+    ano: Optional[int],
+    uf_col: Optional[str],
+    met_col: Optional[str],
+    oper: str,
+    _grupo: pd.DataFrame,
+) -> Optional[pdk.Deck]:
+    """Deck do mapa por UF (None se nenhuma UF tem centroide)."""
+    # `_grupo` é função das demais chaves (ver `agrega_por_uf`): o Deck é reaproveitado
+    # enquanto base/filtros não mudam, em vez de refeito a cada rerun
+    vmax = float(_grupo["valor"].max() or 1.0)
+    plot_df = _grupo.merge(UF_CENTER_DF, on="uf", how="inner")
+    if plot_df.empty:
+        return None
+    plot_df["valor"] = plot_df["valor"].astype(float).fillna(0.0)
+    # raio em metros inteiros: o mapa não precisa de casas decimais e o JSON encolhe
+    plot_df["radius"] = np.round(6000 + 4000 * np.sqrt(plot_df["valor"].to_numpy() / (vmax if vmax else 1)))
+    plot_df["valor_formatado"] = format_series(plot_df["valor"])
+
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        # só as colunas que a camada/tooltip usam vão para o payload do navegador
+        data=plot_df[["uf", "lon", "lat", "radius", "valor_formatado"]],
+        get_position=["lon", "lat"],
+        get_radius="radius",
+        get_fill_color=[220, 38, 38, 180],
+        pickable=True,
+    )
+    view_state, tooltip = _mapa_config()
+    return pdk.Deck(
+        layers=[layer],
+        initial_view_state=view_state,
+        tooltip=tooltip,
+        map_style="light",
     )
 
-@st.cache_data(ttl=3600, show_spinner="Carregando dados da ANVISA...")
-def get_default_dataframe() -> pd.DataFrame:
-    df = read_csv_robusto(DEFAULT_URL, uploaded=False)
-    return normaliza_colunas(df)
+def define_base(df: pd.DataFrame, df_id: Optional[str] = None) -> None:
+    # `df_id` identifica o conteúdo nas chaves dos caches; sem ele (URL), um id aleatório
+    st.session_state["hemoprod_df"] = df
+    st.session_state["hemoprod_df_id"] = df_id or uuid.uuid4().hex
 
 # =============================================================================
 # Páginas
@@ -196,7 +626,7 @@ def pagina_anvisa():
     st.header("Painel de Estoques e Produção Hemoterápica — ANVISA (Hemoprod)")
 
     if "hemoprod_df" not in st.session_state:
-        st.session_state["hemoprod_df"] = get_default_dataframe()
+        define_base(*get_default_dataframe())
 
     with st.expander("Carregar dados (URL ou Upload)", expanded=False):
         url = st.text_input("Cole a URL do CSV aqui", DEFAULT_URL, key="hemoprod_url")
@@ -210,21 +640,24 @@ def pagina_anvisa():
 
     if limpar:
         st.session_state.pop("hemoprod_df", None)
-        st.session_state["hemoprod_df"] = get_default_dataframe()
+        define_base(*get_default_dataframe())
         st.success("Base limpa. Dados padrão recarregados.")
         st.rerun()
         return
 
     if carregar or (up is not None):
         try:
+            df_id = None
             if up is not None:
                 with st.spinner("Lendo arquivo enviado..."):
-                    df = read_csv_robusto(up.getvalue(), uploaded=True)
+                    byts = up.getvalue()
+                    chave = xxhash.xxh3_64_hexdigest(byts)
+                    df = read_csv_robusto(byts, uploaded=True, chave=chave)
+                df_id = f"upload:{chave}"
             else:
                 with st.spinner(f"Baixando de {url}..."):
                     df = read_csv_robusto(url, uploaded=False)
-            df = normaliza_colunas(df)
-            st.session_state["hemoprod_df"] = df
+            define_base(otimiza_tipos(normaliza_colunas(df)), df_id)
             st.success("Base carregada com sucesso!")
             st.rerun()
             return
@@ -237,18 +670,16 @@ def pagina_anvisa():
         st.info("O painel está vazio. Tente carregar a URL ou enviar um CSV.")
         return
 
-    col_ano, col_uf, metricas = detecta_colunas(df)
+    col_ano, col_uf, metricas = detecta_colunas_base(st.session_state["hemoprod_df_id"], df)
 
     c1, c2, c3, c4 = st.columns([1.2, 1.2, 1.6, 1])
     with c1:
         anos_opc = ["(Todos)"]
         ano_recente = None
-        if col_ano and df[col_ano].notna().any():
-            anos_num = pd.to_numeric(df[col_ano], errors="coerce")
-            if anos_num.notna().any():
-                anos_unicos = sorted(list(set(anos_num.dropna().astype(int).tolist())), reverse=True)
-                ano_recente = int(anos_num.dropna().max())
-                anos_opc = ["(Todos)", "(Mais recente)"] + anos_unicos
+        anos_unicos = anos_base(st.session_state["hemoprod_df_id"], df, col_ano) if col_ano else []
+        if anos_unicos:
+            ano_recente = anos_unicos[0]
+            anos_opc = ["(Todos)", "(Mais recente)"] + anos_unicos
         ano_escolhido = st.selectbox("Ano", anos_opc, index=0, key="anv_ano")
 
     with c2:
@@ -266,55 +697,10 @@ def pagina_anvisa():
     with c4:
         oper = st.selectbox("Agregação", ["Soma", "Contagem"], index=0, key="anv_oper")
 
-    df_ag = df.copy()
-    if col_ano and ano_escolhido != "(Todos)":
-        if ano_escolhido == "(Mais recente)" and (ano_recente is not None):
-            df_ag = df_ag[df_ag[col_ano].astype(str) == str(ano_recente)]
-        elif ano_escolhido not in {"(Todos)", "(Mais recente)"}:
-            df_ag = df_ag[df_ag[col_ano].astype(str) == str(ano_escolhido)]
-
-    total_reg = len(df_ag)
-    anos_dist = df_ag[col_ano].nunique(dropna=True) if col_ano else 0
-    ufs_dist = df_ag[uf_col].nunique(dropna=True) if uf_col else 0
-
-    if uf_col:
-        uf_norm = df_ag[uf_col].astype(str).map(uf_para_sigla)
-        uf_norm = uf_norm.fillna(df_ag[uf_col].astype(str).str.upper().str.strip())
-        df_ag = df_ag.assign(__uf__=uf_norm)
-
-        if oper == "Soma":
-            valores = to_numeric_safe(df_ag[met_col])
-            df_ag = df_ag.assign(__valor__=valores)
-        else:
-            df_ag = df_ag.assign(__valor__=1.0)
-
-        grupo = (
-            df_ag.groupby("__uf__", dropna=False, as_index=False)["__valor__"]
-            .sum()
-            .rename(columns={"__uf__": "uf", "__valor__": "valor"})
-        )
-        grupo["uf"] = grupo["uf"].astype(str).str.upper().str.strip()
-        grupo = grupo[grupo["uf"].isin(UF_CENTER.keys())]
-
-        # Correção apenas para RJ e SP quando Soma zerar
-        if oper == "Soma":
-            alvo = {"RJ", "SP"}
-            zerados = grupo[grupo["uf"].isin(alvo) & ((grupo["valor"].isna()) | (grupo["valor"] == 0))]
-            if not zerados.empty:
-                contagem = (
-                    df_ag[df_ag["__uf__"].isin(alvo)]
-                    .groupby("__uf__", dropna=False)
-                    .size()
-                    .reset_index(name="cont")
-                    .rename(columns={"__uf__": "uf"})
-                )
-                for _, r in zerados.iterrows():
-                    uf = r["uf"]
-                    cont = contagem.loc[contagem["uf"] == uf, "cont"]
-                    if not cont.empty:
-                        grupo.loc[grupo["uf"] == uf, "valor"] = float(cont.values[0])
-    else:
-        grupo = pd.DataFrame(columns=["uf", "valor"])
+    ano_filtro = {"(Todos)": None, "(Mais recente)": ano_recente}.get(ano_escolhido, ano_escolhido)
+    grupo, total_reg, anos_dist, ufs_dist = agrega_por_uf(
+        st.session_state["hemoprod_df_id"], df, col_ano, ano_filtro, uf_col, met_col, oper
+    )
 
     total_agregado = float(grupo["valor"].sum()) if len(grupo) else 0.0
 
@@ -333,39 +719,9 @@ def pagina_anvisa():
     if len(grupo) == 0:
         st.info("Não há dados suficientes para o mapa (verifique a coluna UF e a agregação).")
     else:
-        plot_df = []
-        vmax = float(grupo["valor"].max() or 1.0)
-        for _, r in grupo.iterrows():
-            uf = r["uf"]
-            val = float(r["valor"]) if pd.notna(r["valor"]) else 0.0
-            if uf in UF_CENTER:
-                lat, lon = UF_CENTER[uf]
-                plot_df.append(dict(uf=uf, valor=val, lat=lat, lon=lon))
-        plot_df = pd.DataFrame(plot_df)
-        if not plot_df.empty:
-            plot_df["radius"] = 6000 + 4000 * np.sqrt(plot_df["valor"] / (vmax if vmax else 1))
-            plot_df["valor_formatado"] = plot_df["valor"].apply(format_number)
-
-            layer = pdk.Layer(
-                "ScatterplotLayer",
-                data=plot_df,
-                get_position=["lon", "lat"],
-                get_radius="radius",
-                get_fill_color=[220, 38, 38, 180],
-                pickable=True,
-            )
-            view_state = pdk.ViewState(latitude=-14.2350, longitude=-51.9253, zoom=3.5)
-            tooltip = {"text": "{uf}: {valor_formatado}"}
-
-            st.pydeck_chart(
-                pdk.Deck(
-                    layers=[layer],
-                    initial_view_state=view_state,
-                    tooltip=tooltip,
-                    map_style="light",
-                ),
-                use_container_width=True,
-            )
+        deck = monta_mapa(st.session_state["hemoprod_df_id"], col_ano, ano_filtro, uf_col, met_col, oper, grupo)
+        if deck is not None:
+            st.pydeck_chart(deck, use_container_width=True)
             st.caption("🔴 Pontos maiores indicam maior valor agregado (escala raiz).")
         else:
             st.info("Sem pontos válidos para plotar (verifique as UFs).")
@@ -374,31 +730,21 @@ def pagina_anvisa():
     st.dataframe(grupo.sort_values("valor", ascending=False), use_container_width=True)
 
     with st.expander(f"Mostrar dados brutos ({len(df)} linhas)", expanded=False):
-        st.dataframe(df, use_container_width=True)
+        # o conteúdo de um expander é enviado mesmo fechado: a base inteira só vai ao
+        # navegador quando pedida
+        if st.checkbox("Carregar tabela completa", key="anv_brutos"):
+            st.dataframe(df, use_container_width=True)
 
 def pagina_links_estaduais():
     st.header("Acesse páginas/oficiais e pesquise por hemocentros do seu estado.")
     
-    ufs = list(UF_CENTER.keys())
-    busca = [f"https://www.google.com/search?q=doar+sangue+{u}+hemocentro" for u in ufs]
-    oficiais = [LINKS_OFICIAIS.get(u, "") for u in ufs]
-
-    df_links = pd.DataFrame(
-        {
-            "UF": ufs,
-            "Site oficial": oficiais,
-            "Busca (fallback)": busca,
-        }
-    )
+    ufs = UF_SIGLAS
 
     # Tabela com colunas clicáveis (Streamlit 1.50)
     st.dataframe(
-        df_links,
+        LINKS_DF,
         use_container_width=True,
-        column_config={
-            "Site oficial": st.column_config.LinkColumn("Site oficial", display_text="Abrir"),
-            "Busca (fallback)": st.column_config.LinkColumn("Busca (fallback)", display_text="Abrir"),
-        },
+        column_config=_links_column_config(),
     )
 
     # Botão por UF
@@ -408,7 +754,7 @@ def pagina_links_estaduais():
         uf_escolhida = st.selectbox("UF", ufs, index=ufs.index("SP") if "SP" in ufs else 0)
     with col2:
         url_oficial = LINKS_OFICIAIS.get(uf_escolhida) or ""
-        url_fallback = f"https://www.google.com/search?q=doar+sangue+{uf_escolhida}+hemocentro"
+        url_fallback = BUSCA_URL.format(uf=uf_escolhida)
         url_final = url_oficial if url_oficial else url_fallback
         st.link_button("Abrir site oficial / busca", url_final, type="primary")
 
@@ -418,7 +764,7 @@ def pagina_cadastro():
         c1, c2, c3 = st.columns([2, 2, 1])
         nome = c1.text_input("Nome completo")
         tel = c2.text_input("Telefone/WhatsApp")
-        uf = c3.selectbox("UF", sorted(UF_CENTER.keys()))
+        uf = c3.selectbox("UF", UF_SIGLAS)
 
         c4, c5, c6 = st.columns([2, 2, 1])
         email = c4.text_input("E-mail")
@@ -481,7 +827,7 @@ def pagina_rj_sp_experimental():
                     df_upload = read_csv_robusto(up_rj_sp.getvalue(), uploaded=True)
                 # Tenta ler como Excel (se for XLSX)
                 elif up_rj_sp.name.endswith('.xlsx'):
-                    df_upload = pd.read_excel(io.BytesIO(up_rj_sp.getvalue()), dtype=str)
+                    df_upload = read_excel_rapido(up_rj_sp.getvalue())
                 else:
                     st.error("Formato de arquivo não suportado. Use CSV ou XLSX.")
                     return
@@ -492,7 +838,10 @@ def pagina_rj_sp_experimental():
                 st.caption(f"Linhas: {len(df_upload)} | Colunas: {len(df_upload.columns)}")
                 
                 st.subheader("Visualização dos Dados Carregados")
-                st.dataframe(df_upload, use_container_width=True)
+                # arquivos grandes: só uma prévia vai para o navegador
+                st.dataframe(df_upload.head(LIMITE_PREVIA), use_container_width=True)
+                if len(df_upload) > LIMITE_PREVIA:
+                    st.caption(f"Exibindo as primeiras {format_number(LIMITE_PREVIA)} linhas.")
 
             except Exception as e:
                 st.error(f"Falha ao ler o arquivo. Verifique o formato e a codificação. Erro: {e}")